@@ -6,6 +6,22 @@ from PyQt5.QtWidgets import (
     QLineEdit, QPushButton, QTextEdit, QInputDialog, QMessageBox, QComboBox
 )
 from PyQt5.QtCore import Qt, pyqtSignal, QObject
+from protocol import (
+    Event, EventType, send_event, recv_event, MAX_FIELD_LENGTH,
+    NICKNAME_TAKEN, ROOM_EXISTS, NO_SUCH_ROOM, WRONG_PASSWORD, INVALID_REQUEST, INVALID_ACTION
+)
+
+CODEC = 'binary'  # 'json' is easier to read when debugging
+
+# Handshake error codes from the server -> (dialog title, message)
+ERROR_MESSAGES = {
+    ROOM_EXISTS: ("Error", "Room already exists with this ID. Please choose a different ID or join it."),
+    NO_SUCH_ROOM: ("Error", "Room does not exist. Please create it or check the ID."),
+    WRONG_PASSWORD: ("Access Denied", "Incorrect password for this room."),
+    INVALID_REQUEST: ("Server Error", "Invalid request or action sent to server."),
+    INVALID_ACTION: ("Server Error", "Invalid request or action sent to server."),
+    NICKNAME_TAKEN: ("Error", "This nickname is already taken in the room. Please choose another one."),
+}
 
 
 class Communicate(QObject):
@@ -58,6 +74,9 @@ class StartWindow(QWidget):
         if not room_id or not room_pass or not nickname:
             QMessageBox.warning(self, "Input Error", "All fields are required.")
             return
+        if any(len(field.encode('utf-8')) > MAX_FIELD_LENGTH for field in (room_id, room_pass, nickname)):
+            QMessageBox.warning(self, "Input Error", f"Fields are limited to {MAX_FIELD_LENGTH} bytes.")
+            return
 
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
@@ -69,36 +88,28 @@ class StartWindow(QWidget):
             QMessageBox.critical(self, "Connection Error", f"An error occurred: {e}")
             return
 
-        # First response from server should be "ROOM"
-        response = self.client_socket.recv(1024).decode('utf-8')
-        if response != "ROOM":
-            QMessageBox.critical(self, "Server Error", "Unexpected server response.")
+        try:
+            # First response from server should be a room prompt
+            response = recv_event(self.client_socket)
+            if response is None or response.type != EventType.ROOM_PROMPT:
+                QMessageBox.critical(self, "Server Error", "Unexpected server response.")
+                self.client_socket.close()
+                return
+
+            send_event(self.client_socket, Event(EventType.ROOM_REQUEST, action=action, room_id=room_id,
+                                                 password=room_pass), CODEC)
+            response = recv_event(self.client_socket)
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, "Connection Error", f"An error occurred: {e}")
             self.client_socket.close()
             return
 
-        room_info = f"{action}:{room_id}:{room_pass}"
-        self.client_socket.send(room_info.encode('utf-8'))
-
-        response = self.client_socket.recv(1024).decode('utf-8')
-
-        if response == "ROOM_EXISTS":
-            QMessageBox.critical(self, "Error", "Room already exists with this ID. Please choose a different ID or join it.")
-            self.client_socket.close()
-            return
-        elif response == "NO_SUCH_ROOM":
-            QMessageBox.critical(self, "Error", "Room does not exist. Please create it or check the ID.")
+        if response is not None and response.type == EventType.ERROR:
+            title, text = ERROR_MESSAGES.get(response.code, ("Error", f"Server error: {response.code}"))
+            QMessageBox.critical(self, title, text)
             self.client_socket.close()
-            return
-        elif response == "WRONG_PASSWORD":
-            QMessageBox.critical(self, "Access Denied", "Incorrect password for this room.")
-            self.client_socket.close()
-            return
-        elif response == "INVALID_REQUEST" or response == "INVALID_ACTION":
-            QMessageBox.critical(self, "Server Error", "Invalid request or action sent to server.")
-            self.client_socket.close()
-            return
-        elif response == "NICK":
-            self.client_socket.send(nickname.encode('utf-8'))
+        elif response is not None and response.type == EventType.NICK_PROMPT:
+            send_event(self.client_socket, Event(EventType.NICK, nickname=nickname), CODEC)
             self.open_chat_window(self.client_socket, nickname, room_id)
         else:
             QMessageBox.critical(self, "Error", f"Unknown server response: {response}")
@@ -133,6 +144,19 @@ class ChatClient(QWidget):
         self.comm.message_received.connect(self.append_message)
         self.comm.redirect_to_start.connect(self.handle_redirect)
 
+        # Server events keyed by type. Handlers return False once the session is over.
+        self.event_handlers = {
+            EventType.CHAT: self.on_chat,
+            EventType.JOIN: self.on_join,
+            EventType.LEAVE: self.on_leave,
+            EventType.KICK: self.on_kick,
+            EventType.ROOM_CLOSED: self.on_room_closed,
+            EventType.SHUTDOWN: self.on_shutdown,
+            EventType.ADMIN_GRANTED: self.on_admin_granted,
+            EventType.HISTORY: self.on_history,
+            EventType.ERROR: self.on_error,
+        }
+
         self.setWindowTitle(f"Chat Client - Room: {self.room_id} - Nickname: {self.nickname}")
         self.setGeometry(400, 100, 500, 500)
 
@@ -167,27 +191,61 @@ class ChatClient(QWidget):
     def append_message(self, message):
         self.chat_display.append(message)
 
+    def on_chat(self, event):
+        self.comm.message_received.emit(f"{event.nickname}: {event.text}")
+        return True
+
+    def on_join(self, event):
+        self.comm.message_received.emit(f"{event.nickname} joined the chat.")
+        return True
+
+    def on_leave(self, event):
+        self.comm.message_received.emit(f"{event.nickname} left the chat.")
+        return True
+
+    def on_kick(self, event):
+        if event.nickname != self.nickname:
+            self.comm.message_received.emit(f"{event.nickname} has been kicked from the room.")
+            return True
+        self.connected = False
+        self.comm.redirect_to_start.emit("You have been kicked by the admin.")
+        return False
+
+    def on_room_closed(self, event):
+        self.connected = False
+        self.comm.redirect_to_start.emit(f"The room '{self.room_id}' has been closed by the admin.")
+        return False
+
+    def on_shutdown(self, event):
+        self.connected = False
+        self.comm.redirect_to_start.emit("The server is shutting down.")
+        return False
+
+    def on_admin_granted(self, event):
+        self.comm.message_received.emit("You are the admin of this room.")
+        return True
+
+    def on_history(self, event):
+        for nickname, text in event.messages:
+            self.comm.message_received.emit(f"{nickname}: {text}")
+        return True
+
+    def on_error(self, event):
+        self.connected = False
+        _, text = ERROR_MESSAGES.get(event.code, ("Error", f"Server error: {event.code}"))
+        self.comm.redirect_to_start.emit(text)
+        return False
+
     def receive_messages(self):
         while self.connected:
             try:
-                message = self.client.recv(1024).decode('utf-8')
-                if not message:
+                event = recv_event(self.client)
+                if event is None:
                     break
 
-                if "you have been kicked" in message.lower():
-                    self.connected = False
-                    self.comm.redirect_to_start.emit("You have been kicked by the admin.")
-                    break
-                elif "room has been closed" in message.lower():
-                    self.connected = False
-                    self.comm.redirect_to_start.emit(f"The room '{self.room_id}' has been closed by the admin.")
-                    break
-                elif "server is shutting down" in message.lower():
-                    self.connected = False
-                    self.comm.redirect_to_start.emit("The server is shutting down.")
+                handler = self.event_handlers.get(event.type)
+                if handler is not None and not handler(event):
                     break
-                else:
-                    self.comm.message_received.emit(message)
 
             except ConnectionResetError:
                 self.connected = False
@@ -207,8 +265,11 @@ class ChatClient(QWidget):
     def send_message(self):
         message = self.input_field.text()
         if message and self.connected:
+            if len(message.encode('utf-8')) > MAX_FIELD_LENGTH:
+                self.chat_display.append(f"Message is too long to send (limit is {MAX_FIELD_LENGTH} bytes).")
+                return
             try:
-                self.client.send(message.encode('utf-8'))
+                send_event(self.client, Event(EventType.CHAT, nickname=self.nickname, text=message), CODEC)
                 self.chat_display.append(f"{self.nickname} (You): {message}")
                 self.input_field.clear()
             except Exception as e:
@@ -220,7 +281,7 @@ class ChatClient(QWidget):
     def leave_room(self):
         if self.connected:
             try:
-                self.client.send("LEAVE_ROOM".encode('utf-8')) # Inform server
+                send_event(self.client, Event(EventType.LEAVE, nickname=self.nickname), CODEC) # Inform server
             except Exception as e:
                 print(f"Error sending leave message: {e}")
             finally:
@@ -0,0 +1,269 @@
+import sys
+import json
+import struct
+import timeit
+from enum import IntEnum
+
+
+class EventType(IntEnum):
+    ROOM_PROMPT = 1     # server -> client: send your room request
+    ROOM_REQUEST = 2    # client -> server: create/join a room
+    NICK_PROMPT = 3     # server -> client: send your nickname
+    NICK = 4            # client -> server: chosen nickname
+    ERROR = 5           # server -> client: handshake rejected
+    JOIN = 6
+    LEAVE = 7
+    CHAT = 8
+    KICK = 9
+    ROOM_CLOSED = 10
+    SHUTDOWN = 11
+    ADMIN_GRANTED = 12
+    HISTORY = 13
+
+
+_event_types = {int(event_type): event_type for event_type in EventType}
+
+# Field names for every event type, in wire order.
+SCHEMA = {
+    EventType.ROOM_PROMPT: (),
+    EventType.ROOM_REQUEST: ('action', 'room_id', 'password'),
+    EventType.NICK_PROMPT: (),
+    EventType.NICK: ('nickname',),
+    EventType.ERROR: ('code',),
+    EventType.JOIN: ('nickname',),
+    EventType.LEAVE: ('nickname',),
+    EventType.CHAT: ('nickname', 'text'),
+    EventType.KICK: ('nickname',),
+    EventType.ROOM_CLOSED: ('room_id',),
+    EventType.SHUTDOWN: (),
+    EventType.ADMIN_GRANTED: ('room_id',),
+    EventType.HISTORY: ('messages',),  # list of (nickname, text) pairs
+}
+
+# Error codes carried by EventType.ERROR
+NICKNAME_TAKEN = "NICKNAME_TAKEN"
+ROOM_EXISTS = "ROOM_EXISTS"
+NO_SUCH_ROOM = "NO_SUCH_ROOM"
+WRONG_PASSWORD = "WRONG_PASSWORD"
+INVALID_REQUEST = "INVALID_REQUEST"
+INVALID_ACTION = "INVALID_ACTION"
+
+# Frame header: codec id (1 byte) + payload length (4 bytes)
+FRAME_HEADER = struct.Struct('!BI')
+MAX_FIELD_LENGTH = 0xFFFF  # Longest string field, in UTF-8 bytes, the binary codec can carry
+MAX_FRAME_SIZE = 1 << 23  # Fits a full HISTORY batch of maximum-length messages
+
+
+def _fits_field(value):
+    # Every codec is held to the binary codec's limit, so a JSON client cannot send a value the server cannot forward
+    return len(value.encode('utf-8')) <= MAX_FIELD_LENGTH
+
+
+class Event:
+    __slots__ = ('type', 'data')
+
+    def __init__(self, type, **data):
+        self.type = EventType(type)
+        fields = SCHEMA[self.type]
+        if len(data) != len(fields) or any(name not in data for name in fields):
+            raise ValueError(f"{self.type.name} expects fields {fields}, got {tuple(data)}")
+        if self.type == EventType.HISTORY:
+            messages = data['messages']
+            if not isinstance(messages, list) or not all(
+                    isinstance(pair, tuple) and len(pair) == 2
+                    and isinstance(pair[0], str) and isinstance(pair[1], str) for pair in messages):
+                raise ValueError("HISTORY messages must be a list of (nickname, text) string pairs")
+            values = [value for pair in messages for value in pair]
+        else:
+            values = data.values()
+            if not all(isinstance(value, str) for value in values):
+                raise ValueError(f"{self.type.name} fields must be strings")
+        if not all(_fits_field(value) for value in values):
+            raise ValueError(f"{self.type.name} field longer than {MAX_FIELD_LENGTH} UTF-8 bytes")
+        self.data = data
+
+    def __getattr__(self, name):
+        try:
+            return self.data[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __eq__(self, other):
+        return isinstance(other, Event) and self.type == other.type and self.data == other.data
+
+    def __repr__(self):
+        return f"Event({self.type.name}, {self.data})"
+
+
+class JsonCodec:
+    """Human-readable encoding, handy when debugging with a packet sniffer."""
+    name = 'json'
+    codec_id = 1
+
+    def encode(self, event):
+        payload = {'type': event.type.name.lower()}
+        payload.update(event.data)
+        return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+    def decode(self, data):
+        payload = json.loads(data)
+        event_type = EventType[payload.pop('type').upper()]
+        if event_type == EventType.HISTORY:
+            messages = payload['messages']
+            if isinstance(messages, list):
+                payload['messages'] = [tuple(pair) if isinstance(pair, list) else pair for pair in messages]
+        return Event(event_type, **payload)
+
+
+class BinaryCodec:
+    """Compact encoding: a type byte followed by length-prefixed UTF-8 strings."""
+    name = 'binary'
+    codec_id = 2
+
+    _type = struct.Struct('!B')
+    _length = struct.Struct('!H')
+
+    def encode(self, event):
+        parts = [self._type.pack(event.type)]
+        if event.type == EventType.HISTORY:
+            messages = event.data['messages']
+            parts.append(self._length.pack(len(messages)))
+            for nickname, text in messages:
+                self._pack_str(parts, nickname)
+                self._pack_str(parts, text)
+        else:
+            for name in SCHEMA[event.type]:
+                self._pack_str(parts, event.data[name])
+        return b''.join(parts)
+
+    def decode(self, data):
+        event_type = _event_types[data[0]]
+        offset = 1
+        if event_type == EventType.HISTORY:
+            (count,) = self._length.unpack_from(data, offset)
+            offset += 2
+            messages = []
+            for _ in range(count):
+                nickname, offset = self._unpack_str(data, offset)
+                text, offset = self._unpack_str(data, offset)
+                messages.append((nickname, text))
+            return Event(event_type, messages=messages)
+        fields = {}
+        for name in SCHEMA[event_type]:
+            fields[name], offset = self._unpack_str(data, offset)
+        return Event(event_type, **fields)
+
+    def _pack_str(self, parts, value):
+        raw = value.encode('utf-8')
+        if len(raw) > MAX_FIELD_LENGTH:
+            raise ValueError("String field too long for binary codec")
+        parts.append(self._length.pack(len(raw)))
+        parts.append(raw)
+
+    def _unpack_str(self, data, offset):
+        (length,) = self._length.unpack_from(data, offset)
+        start = offset + 2
+        end = start + length
+        if end > len(data):
+            raise ValueError("Truncated binary event")
+        return data[start:end].decode('utf-8'), end
+
+
+CODECS = {}  # {name: codec}
+_codecs_by_id = {}  # {codec_id: codec}
+
+
+def register_codec(codec):
+    CODECS[codec.name] = codec
+    _codecs_by_id[codec.codec_id] = codec
+
+
+register_codec(JsonCodec())
+register_codec(BinaryCodec())
+
+
+def encode_frame(event, codec='binary'):
+    """Encode an event into a framed message ready to be written to a socket.
+
+    The frame records which codec was used, so receivers decode any codec.
+    """
+    codec = CODECS[codec]
+    payload = codec.encode(event)
+    return FRAME_HEADER.pack(codec.codec_id, len(payload)) + payload
+
+
+def send_event(sock, event, codec='binary'):
+    sock.sendall(encode_frame(event, codec))
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_event(sock):
+    """Read one framed event from the socket. Returns None when the peer closes.
+
+    Raises ValueError if the frame or its payload is malformed.
+    """
+    header = _recv_exactly(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    codec_id, length = FRAME_HEADER.unpack(header)
+    if codec_id not in _codecs_by_id:
+        raise ValueError(f"Unknown codec id: {codec_id}")
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame too large: {length} bytes")
+    payload = _recv_exactly(sock, length) if length else b''
+    if payload is None:
+        return None
+    codec = _codecs_by_id[codec_id]
+    try:
+        return codec.decode(payload)
+    except Exception as e:
+        # Malformed payloads fail in many ways (IndexError, KeyError, struct.error, ...);
+        # callers only need to handle ValueError.
+        raise ValueError(f"Malformed {codec.name} event: {e!r}") from e
+
+
+def sample_events():
+    return [
+        Event(EventType.ROOM_PROMPT),
+        Event(EventType.ROOM_REQUEST, action="JOIN", room_id="lobby", password="secret"),
+        Event(EventType.NICK_PROMPT),
+        Event(EventType.NICK, nickname="alice"),
+        Event(EventType.ERROR, code=NICKNAME_TAKEN),
+        Event(EventType.JOIN, nickname="alice"),
+        Event(EventType.LEAVE, nickname="alice"),
+        Event(EventType.CHAT, nickname="alice", text="Hello everyone, how is it going?"),
+        Event(EventType.KICK, nickname="bob"),
+        Event(EventType.ROOM_CLOSED, room_id="lobby"),
+        Event(EventType.SHUTDOWN),
+        Event(EventType.ADMIN_GRANTED, room_id="lobby"),
+        Event(EventType.HISTORY, messages=[("alice", "hi"), ("bob", "hello there")] * 10),
+    ]
+
+
+def benchmark(iterations=20000):
+    """Print encode/decode throughput and encoded size per event type for each codec."""
+    events = sample_events()
+    print(f"{'codec':<8}{'event':<15}{'bytes':>7}{'encode/s':>12}{'decode/s':>12}")
+    for name, codec in CODECS.items():
+        for event in events:
+            encoded = codec.encode(event)
+            if codec.decode(encoded) != event:
+                raise AssertionError(f"{name} codec does not round-trip {event!r}")
+            encode_time = timeit.timeit(lambda: codec.encode(event), number=iterations)
+            decode_time = timeit.timeit(lambda: codec.decode(encoded), number=iterations)
+            print(f"{name:<8}{event.type.name.lower():<15}{len(encoded):>7}"
+                  f"{iterations / encode_time:>12.0f}{iterations / decode_time:>12.0f}")
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
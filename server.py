@@ -1,163 +1,22 @@
 import sys
 import socket
-import threading
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QLabel, QListWidget,
     QPushButton, QMessageBox, QHBoxLayout, QInputDialog
 )
 from PyQt5.QtCore import Qt, pyqtSignal, QObject, QTimer
+import server_core
+from server_core import rooms, kick_client
 
 # Global Variables
 HOST = '192.168.1.10'
 PORT = 1111
 
-server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-
-rooms = {}  # {room_id: {'password': str, 'clients': [socket], 'nicknames': [str], 'admin': str}}
-client_room_map = {}  # client_socket: room_id
-server_running = False
-server_socket_lock = threading.Lock() # To protect server socket operations during stop/start
-
 class ServerSignals(QObject):
     update_gui = pyqtSignal()
 
 server_signals = ServerSignals()
-
-def broadcast(room_id, message, sender=None):
-    if room_id not in rooms:
-        return # Room might have been closed
-
-    clients_to_remove = []
-    for client in rooms[room_id]['clients']:
-        if client != sender:
-            try:
-                client.send(message.encode('utf-8'))
-            except:
-                clients_to_remove.append(client)
-    
-    # Remove disconnected clients
-    for client in clients_to_remove:
-        remove_client_from_room(client, room_id)
-
-
-def remove_client_from_room(client, room_id):
-    if room_id in rooms:
-        try:
-            idx = rooms[room_id]['clients'].index(client)
-            nickname = rooms[room_id]['nicknames'][idx]
-            rooms[room_id]['clients'].pop(idx)
-            rooms[room_id]['nicknames'].pop(idx)
-            if client in client_room_map:
-                del client_room_map[client]
-            client.close()
-            broadcast(room_id, f"{nickname} left the chat.")
-            server_signals.update_gui.emit() # Update GUI after client leaves
-        except ValueError:
-            pass # Client not found in list
-        except Exception as e:
-            print(f"Error removing client from room: {e}")
-
-def handle_client(client, room_id):
-    nickname = None
-    try:
-        nickname = client.recv(1024).decode('utf-8')
-        if not nickname: # Client disconnected before sending nickname
-            client.close()
-            return
-
-        # Check if nickname already exists in the room
-        if nickname in rooms[room_id]['nicknames']:
-            client.send("NICKNAME_TAKEN".encode('utf-8')) # This message is not handled by client yet
-            client.close()
-            return
-
-        rooms[room_id]['clients'].append(client)
-        rooms[room_id]['nicknames'].append(nickname)
-        client_room_map[client] = room_id
-
-        if rooms[room_id]['admin'] is None:
-            rooms[room_id]['admin'] = nickname
-            client.send("You are the admin of this room.".encode('utf-8'))
-
-        broadcast(room_id, f"{nickname} joined the chat.", sender=client)
-        server_signals.update_gui.emit() # Update GUI after client joins
-
-        while True:
-            message = client.recv(1024).decode('utf-8')
-            if not message:
-                break # Client disconnected
-            if message == "LEAVE_ROOM":
-                break # Client explicitly left
-            broadcast(room_id, f"{nickname}: {message}", sender=client)
-    except ConnectionResetError:
-        print(f"Client {nickname} disconnected unexpectedly from room {room_id}.")
-    except Exception as e:
-        print(f"Error handling client {nickname} in room {room_id}: {e}")
-    finally:
-        if client in client_room_map:
-            remove_client_from_room(client, room_id)
-
-
-def accept_connections():
-    global server_running
-    while server_running:
-        try:
-            # Set timeout to allow checking server_running flag
-            server.settimeout(1.0)
-            
-            with server_socket_lock:
-                if not server_running:
-                    break
-                try:
-                    client, addr = server.accept()
-                except socket.timeout:
-                    continue  # Timeout occurred, check server_running again
-            
-            client.send("ROOM".encode('utf-8'))
-            room_data = client.recv(1024).decode('utf-8')
-
-            try:
-                action, room_id, password = room_data.split(":", 2)
-            except ValueError:
-                client.send("INVALID_REQUEST".encode('utf-8'))
-                client.close()
-                continue
-
-            if action == "CREATE":
-                if room_id in rooms:
-                    client.send("ROOM_EXISTS".encode('utf-8'))
-                    client.close()
-                    continue
-                rooms[room_id] = {'password': password, 'clients': [], 'nicknames': [], 'admin': None}
-            elif action == "JOIN":
-                if room_id not in rooms:
-                    client.send("NO_SUCH_ROOM".encode('utf-8'))
-                    client.close()
-                    continue
-                if rooms[room_id]['password'] != password:
-                    client.send("WRONG_PASSWORD".encode('utf-8'))
-                    client.close()
-                    continue
-            else:
-                client.send("INVALID_ACTION".encode('utf-8'))
-                client.close()
-                continue
-
-            client.send("NICK".encode('utf-8'))
-            threading.Thread(target=handle_client, args=(client, room_id)).start()
-            server_signals.update_gui.emit() # Update GUI after room creation/join
-            
-        except socket.timeout:
-            continue
-        except OSError as e:
-            if server_running: # Only print error if server was supposed to be running
-                print(f"Server accept error: {e}")
-            break # Server socket likely closed
-        except Exception as e:
-            print(f"Error in accept_connections: {e}")
-            if not server_running:
-                break
+server_core.change_listeners.append(server_signals.update_gui.emit)
 
 
 class ChatServerGUI(QWidget):
@@ -223,7 +82,7 @@ class ChatServerGUI(QWidget):
 
     def update_room_list(self):
         self.room_list.clear()
-        for room_id, data in rooms.items():
+        for room_id, data in list(rooms.items()): # Copy, other threads may change rooms
             admin = data['admin'] if data['admin'] else "None"
             password = data['password']
             num_clients = len(data['clients'])
@@ -272,19 +131,11 @@ class ChatServerGUI(QWidget):
         for user_item in selected_users:
            user_nick = user_item.text()
            try:
-             if user_nick not in rooms[room_id]['nicknames']:
+             if room_id not in rooms or user_nick not in rooms[room_id]['nicknames']:
                  QMessageBox.warning(self, "Warning", f"User {user_nick} is no longer in room {room_id}.")
                  continue
 
-             index = rooms[room_id]['nicknames'].index(user_nick)
-             client_to_kick = rooms[room_id]['clients'][index]
-
-             client_to_kick.send("You have been kicked by the admin.".encode('utf-8'))
-             
-             # Remove client from server's tracking
-             remove_client_from_room(client_to_kick, room_id)
-             
-             broadcast(room_id, f"{user_nick} has been kicked from the room.")
+             kick_client(room_id, user_nick)
              QMessageBox.information(self, "Success", f"User {user_nick} has been kicked.")
 
            except ValueError:
@@ -316,17 +167,7 @@ class ChatServerGUI(QWidget):
                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
 
         if reply == QMessageBox.Yes:
-            if room_id in rooms:
-                # Notify all clients in the room and disconnect them
-                clients_to_disconnect = list(rooms[room_id]['clients']) # Create a copy
-                for client in clients_to_disconnect:
-                    try:
-                        client.send(f"The room '{room_id}' has been closed by the admin.".encode('utf-8'))
-                        remove_client_from_room(client, room_id)
-                    except Exception as e:
-                        print(f"Error disconnecting client during room close: {e}")
-                
-                del rooms[room_id]
+            if server_core.close_room(room_id):
                 QMessageBox.information(self, "Room Closed", f"Room '{room_id}' has been successfully closed.")
                 self.last_selected_room_id = None # Reset selected room
                 self.update_all_lists()
@@ -335,7 +176,7 @@ class ChatServerGUI(QWidget):
 
 
     def update_server_status_label(self):
-        if server_running:
+        if server_core.server_running:
             self.server_status_label.setText("Server Status: Running")
             self.server_status_label.setStyleSheet("font-weight: bold; color: green;")
         else:
@@ -343,62 +184,31 @@ class ChatServerGUI(QWidget):
             self.server_status_label.setStyleSheet("font-weight: bold; color: red;")
 
     def start_server(self):
-        global server_running, server
-        if not server_running:
+        if not server_core.server_running:
             try:
-                with server_socket_lock:
-                    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                    server.bind((HOST, PORT))
-                    server.listen()
-                    server_running = True
-                
-                self.server_thread = threading.Thread(target=accept_connections, daemon=True)
-                self.server_thread.start()
+                server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                server.bind((HOST, PORT))
+                server.listen()
+
+                self.server_thread = server_core.start_server(server)
                 self.start_button.setEnabled(False)
                 self.stop_button.setEnabled(True)
                 self.update_server_status_label()
                 QMessageBox.information(self, "Server Started", "Chat server is now running.")
             except Exception as e:
                 QMessageBox.critical(self, "Start Error", f"Failed to start server: {e}")
-                server_running = False 
+                server_core.server_running = False
                 self.update_server_status_label()
 
 
     def stop_server(self):
-        global server_running, server
-        if server_running:
+        if server_core.server_running:
             reply = QMessageBox.question(self, 'Stop Server',
                                          "Are you sure you want to stop the server? All active connections will be terminated.",
                                          QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
             if reply == QMessageBox.Yes:
-                server_running = False
-                
-               
-                all_clients = []
-                for room_id in list(rooms.keys()): # Iterate over a copy
-                    for client in rooms[room_id]['clients']:
-                        all_clients.append(client)
-                
-                for client in all_clients:
-                    try:
-                        client.send("The server is shutting down.".encode('utf-8'))
-                        client.close()
-                    except Exception as e:
-                        print(f"Error notifying client during server stop: {e}")
-
-                
-                rooms.clear()
-                client_room_map.clear()
-
-                with server_socket_lock:
-                    try:
-                        server.shutdown(socket.SHUT_RDWR)
-                        server.close()
-                    except OSError as e:
-                        print(f"Error shutting down server socket: {e}")
-                    except Exception as e:
-                        print(f"Unexpected error closing server socket: {e}")
+                server_core.stop_server()
 
                 self.start_button.setEnabled(True)
                 self.stop_button.setEnabled(False)
@@ -411,13 +221,13 @@ class ChatServerGUI(QWidget):
             QMessageBox.information(self, "Server Status", "Server is already stopped.")
 
     def closeEvent(self, event):
-        if server_running:
+        if server_core.server_running:
             reply = QMessageBox.question(self, 'Exit Server Admin',
                                          "The server is currently running. Do you want to stop it before exiting?",
                                          QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel, QMessageBox.Yes)
             if reply == QMessageBox.Yes:
                 self.stop_server()
-                if server_running: # If stop failed or user cancelled within stop_server
+                if server_core.server_running: # If stop failed or user cancelled within stop_server
                     event.ignore()
                     return
             elif reply == QMessageBox.Cancel:
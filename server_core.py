@@ -0,0 +1,405 @@
+import socket
+import threading
+from collections import deque
+from protocol import (
+    Event, EventType, encode_frame, send_event, recv_event,
+    NICKNAME_TAKEN, ROOM_EXISTS, NO_SUCH_ROOM, WRONG_PASSWORD, INVALID_REQUEST, INVALID_ACTION
+)
+
+CODEC = 'binary'  # 'json' is easier to read when debugging
+HISTORY_SIZE = 50  # Chat messages replayed to clients when they join
+OUTBOX_SIZE = 1000  # Frames queued for one client before it is dropped as too slow
+CLOSE_TIMEOUT = 5.0  # Seconds a closing client gets to receive its queued frames
+
+rooms = {}  # {room_id: {'password': str, 'clients': [socket], 'nicknames': [str], 'admin': str, 'history': deque}}
+client_room_map = {}  # client_socket: room_id
+outboxes = {}  # client_socket: Outbox
+state_lock = threading.RLock() # Protects rooms, client_room_map and outboxes. Never held while sending.
+
+server = None # Listening socket (or any object with settimeout/accept/shutdown/close)
+server_running = False
+server_socket_lock = threading.Lock() # To protect server socket operations during stop/start
+
+change_listeners = [] # Callables run whenever rooms or their members change (e.g. to refresh the GUI)
+
+
+def notify_change():
+    for listener in change_listeners:
+        listener()
+
+
+def close_client(client):
+    # Only shut the socket down: this wakes the handle_client thread blocked in recv(),
+    # which then closes it. Closing it here could pull the descriptor out from under that thread.
+    try:
+        client.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+# Lets the broadcasting thread write directly when a client's socket has room (not available on Windows)
+MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+
+
+class Outbox:
+    """Frames waiting to be written to one client.
+
+    Sends never block the caller: a frame is written straight away only if the
+    socket has room for it, otherwise it is queued for a dedicated writer thread.
+    A client that stops reading therefore only ever stalls its own writer.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.frames = deque() # None marks the end of the connection
+        self.lock = threading.Lock() # Keeps frames in order between send() and the writer
+        self.ready = threading.Event()
+        self.writing = False
+        self.closing = False
+        self.close_timer = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def send(self, frame):
+        """Send or queue a frame. Returns False, and drops the connection, if the client is gone or too far behind."""
+        with self.lock:
+            if self.closing:
+                return False
+            if MSG_DONTWAIT and not self.frames and not self.writing:
+                try:
+                    sent = self.client.send(frame, MSG_DONTWAIT)
+                except BlockingIOError:
+                    sent = 0
+                except OSError:
+                    self._abort()
+                    return False
+                if sent == len(frame):
+                    return True
+                frame = frame[sent:]
+            if len(self.frames) >= OUTBOX_SIZE:
+                self._abort()
+                return False
+            self.frames.append(frame)
+        self.ready.set()
+        return True
+
+    def _abort(self):
+        # Called with self.lock held: drop whatever is queued and disconnect now
+        self.closing = True
+        self.frames.clear()
+        self.frames.append(None)
+        self.ready.set()
+        close_client(self.client)
+
+    def close(self):
+        """Disconnect once the frames already queued are written, or after CLOSE_TIMEOUT."""
+        with self.lock:
+            if self.closing:
+                return
+            self.closing = True
+            self.close_timer = threading.Timer(CLOSE_TIMEOUT, close_client, args=(self.client,))
+            self.close_timer.daemon = True
+            self.close_timer.start()
+            self.frames.append(None)
+        self.ready.set()
+
+    def run(self):
+        closing = False
+        while not closing:
+            self.ready.wait()
+            with self.lock:
+                self.ready.clear()
+                batch = list(self.frames)
+                self.frames.clear()
+                self.writing = True
+            if None in batch:
+                closing = True
+                batch = batch[:batch.index(None)]
+            try:
+                # Write everything queued so far in one call; a busy room queues many small frames
+                if batch:
+                    self.client.sendall(b''.join(batch))
+            except OSError:
+                break
+            with self.lock:
+                self.writing = False
+        close_client(self.client)
+        if self.close_timer is not None:
+            self.close_timer.cancel()
+
+
+def broadcast(room_id, event, sender=None):
+    broadcast_frame(room_id, encode_frame(event, CODEC), sender) # Encode once for every recipient
+
+
+def broadcast_frame(room_id, frame, sender=None):
+    with state_lock:
+        if room_id not in rooms:
+            return # Room might have been closed
+        recipients = [(client, outboxes[client]) for client in rooms[room_id]['clients'] if client != sender]
+
+    # Remove clients that can no longer keep up
+    for client, outbox in recipients:
+        if not outbox.send(frame):
+            remove_client_from_room(client, room_id)
+
+
+def remove_client_from_room(client, room_id):
+    with state_lock:
+        if room_id not in rooms:
+            return
+        try:
+            idx = rooms[room_id]['clients'].index(client)
+        except ValueError:
+            return # Client not found in list
+        # Encode before changing anything, so a failure cannot leave the client half removed
+        frame = encode_frame(Event(EventType.LEAVE, nickname=rooms[room_id]['nicknames'][idx]), CODEC)
+        rooms[room_id]['clients'].pop(idx)
+        rooms[room_id]['nicknames'].pop(idx)
+        client_room_map.pop(client, None)
+        outbox = outboxes.pop(client)
+
+    outbox.close()
+    broadcast_frame(room_id, frame)
+    notify_change() # Update GUI after client leaves
+
+
+def kick_client(room_id, nickname):
+    """Disconnect a user from a room. Raises ValueError if they are not in it."""
+    frame = encode_frame(Event(EventType.KICK, nickname=nickname), CODEC)
+    with state_lock:
+        if room_id not in rooms:
+            raise ValueError(f"Room {room_id} does not exist.")
+        index = rooms[room_id]['nicknames'].index(nickname)
+        client_to_kick = rooms[room_id]['clients'][index]
+        outbox = outboxes[client_to_kick]
+
+    outbox.send(frame)
+
+    # Remove client from server's tracking
+    remove_client_from_room(client_to_kick, room_id)
+
+    broadcast_frame(room_id, frame)
+
+
+def close_room(room_id):
+    """Notify and disconnect everyone in a room, then delete it. Returns False if it does not exist."""
+    # Encode before changing anything, so a failure cannot leave members without a room or a notice
+    frame = encode_frame(Event(EventType.ROOM_CLOSED, room_id=room_id), CODEC)
+    with state_lock:
+        if room_id not in rooms:
+            return False
+        members = [outboxes.pop(client) for client in rooms[room_id]['clients']]
+        for client in rooms[room_id]['clients']:
+            client_room_map.pop(client, None)
+        del rooms[room_id]
+
+    # Notify all clients in the room and disconnect them
+    for outbox in members:
+        outbox.send(frame)
+        outbox.close()
+    notify_change()
+    return True
+
+
+def handle_chat_event(client, room_id, nickname, event):
+    # Encode before storing, so a message that cannot be sent never reaches the history
+    frame = encode_frame(Event(EventType.CHAT, nickname=nickname, text=event.text), CODEC)
+    with state_lock:
+        if room_id not in rooms:
+            return True
+        rooms[room_id]['history'].append((nickname, event.text))
+    broadcast_frame(room_id, frame, sender=client)
+    return True
+
+
+def handle_leave_event(client, room_id, nickname, event):
+    return False # Client explicitly left
+
+
+# Events a joined client may send, keyed by type. Handlers return False to end the session.
+client_event_handlers = {
+    EventType.CHAT: handle_chat_event,
+    EventType.LEAVE: handle_leave_event,
+}
+
+
+def handle_client(client, room_id):
+    nickname = None
+    outbox = None
+    try:
+        try:
+            nick_event = recv_event(client)
+        except ValueError: # Malformed, or a nickname too long to send to the rest of the room
+            send_event(client, Event(EventType.ERROR, code=INVALID_REQUEST), CODEC)
+            return
+        if nick_event is None or nick_event.type != EventType.NICK: # Client disconnected before sending nickname
+            return
+        nickname = nick_event.nickname
+
+        with state_lock:
+            error = None
+            if room_id not in rooms:
+                error = NO_SUCH_ROOM # Room was closed during the handshake
+            elif nickname in rooms[room_id]['nicknames']: # Check if nickname already exists in the room
+                error = NICKNAME_TAKEN
+            else:
+                outbox = Outbox(client)
+                rooms[room_id]['clients'].append(client)
+                rooms[room_id]['nicknames'].append(nickname)
+                client_room_map[client] = room_id
+                outboxes[client] = outbox
+
+                is_admin = rooms[room_id]['admin'] is None
+                if is_admin:
+                    rooms[room_id]['admin'] = nickname
+                history = list(rooms[room_id]['history'])
+
+        if error is not None:
+            send_event(client, Event(EventType.ERROR, code=error), CODEC)
+            return
+
+        if is_admin:
+            outbox.send(encode_frame(Event(EventType.ADMIN_GRANTED, room_id=room_id), CODEC))
+        if history:
+            outbox.send(encode_frame(Event(EventType.HISTORY, messages=history), CODEC))
+
+        broadcast(room_id, Event(EventType.JOIN, nickname=nickname), sender=client)
+        notify_change() # Update GUI after client joins
+
+        while True:
+            event = recv_event(client)
+            if event is None:
+                break # Client disconnected
+            handler = client_event_handlers.get(event.type)
+            if handler is not None and not handler(client, room_id, nickname, event):
+                break
+    except ConnectionResetError:
+        print(f"Client {nickname} disconnected unexpectedly from room {room_id}.")
+    except Exception as e:
+        print(f"Error handling client {nickname} in room {room_id}: {e}")
+    finally:
+        if client in client_room_map:
+            remove_client_from_room(client, room_id)
+        if outbox is not None:
+            outbox.close()
+            outbox.thread.join() # Don't close the socket under the writer
+        client.close()
+
+
+def negotiate_room(client):
+    """Run the create/join handshake. Returns the room id, or None if the client was rejected."""
+    send_event(client, Event(EventType.ROOM_PROMPT), CODEC)
+    try:
+        request = recv_event(client)
+    except ValueError: # Malformed, or a room id or password too long to send back
+        request = None
+    if request is None or request.type != EventType.ROOM_REQUEST:
+        send_event(client, Event(EventType.ERROR, code=INVALID_REQUEST), CODEC)
+        return None
+    action, room_id, password = request.action, request.room_id, request.password
+
+    with state_lock:
+        error = None
+        if action == "CREATE":
+            if room_id in rooms:
+                error = ROOM_EXISTS
+            else:
+                rooms[room_id] = {'password': password, 'clients': [], 'nicknames': [], 'admin': None,
+                                  'history': deque(maxlen=HISTORY_SIZE)}
+        elif action == "JOIN":
+            if room_id not in rooms:
+                error = NO_SUCH_ROOM
+            elif rooms[room_id]['password'] != password:
+                error = WRONG_PASSWORD
+        else:
+            error = INVALID_ACTION
+
+    if error is not None:
+        send_event(client, Event(EventType.ERROR, code=error), CODEC)
+        return None
+
+    send_event(client, Event(EventType.NICK_PROMPT), CODEC)
+    return room_id
+
+
+def serve_client(client, addr):
+    # Runs on its own thread, so a client that stalls during the handshake cannot hold up accept()
+    try:
+        room_id = negotiate_room(client)
+    except (OSError, ValueError) as e:
+        print(f"Handshake with {addr} failed: {e}")
+        room_id = None
+    if room_id is None:
+        client.close()
+        return
+
+    notify_change() # Update GUI after room creation/join
+    handle_client(client, room_id)
+
+
+def accept_connections():
+    global server_running
+    while server_running:
+        try:
+            # Set timeout to allow checking server_running flag
+            server.settimeout(1.0)
+
+            with server_socket_lock:
+                if not server_running:
+                    break
+                try:
+                    client, addr = server.accept()
+                except socket.timeout:
+                    continue  # Timeout occurred, check server_running again
+
+            threading.Thread(target=serve_client, args=(client, addr), daemon=True).start()
+
+        except socket.timeout:
+            continue
+        except OSError as e:
+            if server_running: # Only print error if server was supposed to be running
+                print(f"Server accept error: {e}")
+            break # Server socket likely closed
+        except Exception as e:
+            print(f"Error in accept_connections: {e}")
+            if not server_running:
+                break
+
+
+def start_server(listener):
+    """Start accepting connections on an already bound and listening socket."""
+    global server, server_running
+    with server_socket_lock:
+        server = listener
+        server_running = True
+    server_thread = threading.Thread(target=accept_connections, daemon=True)
+    server_thread.start()
+    return server_thread
+
+
+def stop_server():
+    """Notify and disconnect every client, forget all rooms and close the listening socket."""
+    global server_running
+    frame = encode_frame(Event(EventType.SHUTDOWN), CODEC)
+    server_running = False
+
+    with state_lock:
+        all_outboxes = list(outboxes.values())
+        rooms.clear()
+        client_room_map.clear()
+        outboxes.clear()
+
+    for outbox in all_outboxes:
+        outbox.send(frame)
+        outbox.close()
+
+    with server_socket_lock:
+        try:
+            server.shutdown(socket.SHUT_RDWR)
+            server.close()
+        except OSError as e:
+            print(f"Error shutting down server socket: {e}")
+        except Exception as e:
+            print(f"Unexpected error closing server socket: {e}")
+    notify_change()
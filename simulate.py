@@ -0,0 +1,579 @@
+"""Seeded in-process simulation of the chat server core.
+
+Runs server_core against in-memory socket pairs instead of a real listening
+socket, scripts clients through joins, chat, kicks, room closes and abrupt
+disconnects while one client stops reading altogether, and checks the server kept its bookkeeping straight:
+no lost members, no duplicate nicknames and exactly-once delivery.
+The script (rooms, nicknames, message order, churn) is generated from
+--seed, so a failing run can be replayed. Thread interleaving is not seeded,
+so timings and the exact order of concurrent events vary between runs.
+
+Delivery latency is measured by a probe: one message at a time sent through
+a room of its own while the chat load runs, so it reflects how long the server
+takes to deliver a message under load rather than how long the load's backlog
+takes to drain.
+
+Chat runs in --rounds rounds and throughput is the median round, so one
+slow round does not fail the run. Join rate, chat throughput and probe
+latency are compared against sim_baseline.json; the run fails if they regress by more than --tolerance.
+Baselines depend on the machine, so the file is not committed: record one
+with --record-baseline before relying on the regression gate. A run with
+no baseline for its configuration fails rather than passing silently.
+
+    python simulate.py --clients 2000 --seed 7
+"""
+import os
+import sys
+import json
+import time
+import queue
+import random
+import statistics
+import socket
+import hashlib
+import argparse
+import threading
+from contextlib import contextmanager
+
+import server_core
+from protocol import Event, EventType, send_event, recv_event, NICKNAME_TAKEN
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sim_baseline.json')
+STALL_FLOOD_MESSAGES = 100 # 60 KB chats sent towards the client that never reads
+STALL_LOCK_TIMEOUT = 1.0 # Seconds the server may stay unresponsive because of it
+PROBE_INTERVAL = 0.005 # Seconds between latency probes
+
+
+class ServerFrozen(Exception):
+    """The server stopped responding; carrying on would only hang the simulation."""
+
+
+class InMemoryListener:
+    """Stands in for the listening socket. connect() hands one end of a socketpair to accept()."""
+
+    def __init__(self):
+        self.pending = queue.Queue()
+        self.timeout = None
+        self.closed = False
+        self.connections = 0
+
+    def connect(self):
+        client_end, server_end = socket.socketpair()
+        self.connections += 1
+        self.pending.put((server_end, ('sim', self.connections)))
+        return client_end, server_end
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def accept(self):
+        if self.closed:
+            raise OSError("Listener is closed")
+        try:
+            return self.pending.get(timeout=self.timeout)
+        except queue.Empty:
+            raise socket.timeout("timed out") from None
+
+    def shutdown(self, how):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+class SimClient:
+    def __init__(self, index, room_id, password, nickname, action, reads=True):
+        self.index = index
+        self.room_id = room_id
+        self.password = password
+        self.nickname = nickname
+        self.action = action # "CREATE" or "JOIN"
+        self.reads = reads # False: stop reading after the handshake, like a hung client
+        self.sock = None
+        self.server_sock = None
+        self.rejected = None # Error code if the server turned us away
+        self.events = [] # (Event, receive time)
+        self.on_event = None # Optional callable(event, receive time), run on the reader thread
+        self.chat_count = 0
+        self.thread = None
+
+    def start(self, listener, codec):
+        self.sock, self.server_sock = listener.connect()
+        self.thread = threading.Thread(target=self.run, args=(codec,), daemon=True)
+        self.thread.start()
+
+    def run(self, codec):
+        try:
+            event = recv_event(self.sock)
+            if event is None or event.type != EventType.ROOM_PROMPT:
+                self.rejected = "NO_ROOM_PROMPT"
+                return
+            send_event(self.sock, Event(EventType.ROOM_REQUEST, action=self.action, room_id=self.room_id,
+                                        password=self.password), codec)
+            event = recv_event(self.sock)
+            if event is None or event.type != EventType.NICK_PROMPT:
+                self.rejected = event.code if event is not None and event.type == EventType.ERROR else "NO_NICK_PROMPT"
+                return
+            send_event(self.sock, Event(EventType.NICK, nickname=self.nickname), codec)
+
+            while self.reads:
+                event = recv_event(self.sock)
+                if event is None:
+                    break
+                received_at = time.perf_counter()
+                self.events.append((event, received_at))
+                if self.on_event is not None:
+                    self.on_event(event, received_at)
+                if event.type == EventType.CHAT:
+                    self.chat_count += 1
+                elif event.type == EventType.ERROR:
+                    self.rejected = event.code
+                    break
+        except OSError:
+            pass # We closed our own end (leave or abrupt disconnect)
+
+    def send(self, event, codec):
+        try:
+            send_event(self.sock, event, codec)
+        except OSError:
+            pass # Server already dropped us
+
+    def disconnect(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def received(self, event_type):
+        return [event for event, _ in self.events if event.type == event_type]
+
+
+class Simulation:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.failures = []
+        self.metrics = {}
+        self.listener = InMemoryListener()
+        self.clients = []
+        self.room_ids = [f"room{i}" for i in range(args.rooms)]
+        self.passwords = {room_id: f"pw{self.rng.randrange(10 ** 6)}" for room_id in self.room_ids}
+
+    def check(self, condition, message):
+        if not condition:
+            self.failures.append(message)
+        return condition
+
+    def admin(self, what, timeout, action, *args):
+        """Run an admin action as the GUI thread would, failing the run instead of hanging if it blocks."""
+        outcome = {}
+
+        def call():
+            try:
+                outcome['result'] = action(*args)
+            except Exception as e:
+                outcome['error'] = e
+
+        thread = threading.Thread(target=call, daemon=True)
+        thread.start()
+        thread.join(timeout)
+        if thread.is_alive():
+            raise ServerFrozen(f"{what} blocked for more than {timeout}s")
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome.get('result')
+
+    @contextmanager
+    def state_lock(self):
+        if not server_core.state_lock.acquire(timeout=self.args.timeout):
+            raise ServerFrozen(f"state_lock was not released within {self.args.timeout}s")
+        try:
+            yield
+        finally:
+            server_core.state_lock.release()
+
+    def wait_until(self, predicate, what):
+        deadline = time.monotonic() + self.args.timeout
+        while not predicate():
+            if time.monotonic() > deadline:
+                self.failures.append(f"Timed out waiting for {what}")
+                return False
+            time.sleep(0.005)
+        return True
+
+    def plan_clients(self):
+        """Assign every client a room and nickname. Some deliberately reuse a nickname already taken in their room."""
+        creators = {}
+        nicknames = {room_id: [] for room_id in self.room_ids}
+        for index in range(self.args.clients):
+            room_id = self.room_ids[index] if index < len(self.room_ids) else self.rng.choice(self.room_ids)
+            if nicknames[room_id] and self.rng.random() < self.args.duplicate_rate:
+                nickname = self.rng.choice(nicknames[room_id])
+            else:
+                nickname = f"user{index}"
+                nicknames[room_id].append(nickname)
+            action = "JOIN" if room_id in creators else "CREATE"
+            client = SimClient(index, room_id, self.passwords[room_id], nickname, action)
+            creators.setdefault(room_id, client)
+            self.clients.append(client)
+        digest = hashlib.sha256(repr([(c.room_id, c.nickname, c.action) for c in self.clients]).encode()).hexdigest()
+        self.metrics['plan_digest'] = digest[:16]
+
+    def members(self):
+        with self.state_lock():
+            return [client for client in self.clients if client.server_sock in server_core.client_room_map]
+
+    def run_joins(self):
+        creators = [client for client in self.clients if client.action == "CREATE"]
+        joiners = [client for client in self.clients if client.action == "JOIN"]
+        started = time.perf_counter()
+        for client in creators:
+            client.start(self.listener, self.args.codec)
+        self.wait_until(lambda: all(c.rejected or c.server_sock in server_core.client_room_map for c in creators),
+                        "room creators to join")
+        for client in joiners:
+            client.start(self.listener, self.args.codec)
+        self.wait_until(lambda: all(c.rejected or c.server_sock in server_core.client_room_map for c in self.clients),
+                        "all clients to join or be rejected")
+        self.metrics['join_rate'] = len(self.clients) / (time.perf_counter() - started)
+
+        # Exactly one client wins each nickname; everyone else is told it is taken
+        by_nickname = {}
+        for client in self.clients:
+            by_nickname.setdefault((client.room_id, client.nickname), []).append(client)
+        joined = set(self.members())
+        for (room_id, nickname), contenders in by_nickname.items():
+            winners = [client for client in contenders if client in joined]
+            self.check(len(winners) == 1, f"{nickname} in {room_id}: {len(winners)} clients hold the nickname")
+            for client in contenders:
+                if client not in joined:
+                    self.check(client.rejected == NICKNAME_TAKEN,
+                               f"client {client.index} was dropped without NICKNAME_TAKEN ({client.rejected})")
+        self.check_rooms({room_id: sorted(c.nickname for c in joined if c.room_id == room_id)
+                          for room_id in self.room_ids})
+        for room_id in self.room_ids:
+            creator = next(client for client in self.clients if client.room_id == room_id)
+            admin = server_core.rooms.get(room_id, {}).get('admin')
+            self.check(admin == creator.nickname, f"{room_id} has admin {admin}, expected {creator.nickname}")
+            self.check(len(creator.received(EventType.ADMIN_GRANTED)) == 1, f"{room_id} creator was not made admin")
+
+    def check_rooms(self, expected):
+        """Compare server state with the expected {room_id: sorted nicknames}."""
+        with self.state_lock():
+            self.check(sorted(server_core.rooms) == sorted(expected),
+                       f"open rooms {sorted(server_core.rooms)} != expected {sorted(expected)}")
+            mapped = 0
+            for room_id, data in server_core.rooms.items():
+                nicknames = data['nicknames']
+                self.check(len(nicknames) == len(set(nicknames)), f"{room_id} has duplicate nicknames")
+                self.check(len(nicknames) == len(data['clients']), f"{room_id} clients and nicknames out of step")
+                self.check(sorted(nicknames) == expected.get(room_id), f"{room_id} members differ from expected")
+                for client in data['clients']:
+                    mapped += 1
+                    self.check(server_core.client_room_map.get(client) == room_id,
+                               f"{room_id} member missing from client_room_map")
+            self.check(mapped == len(server_core.client_room_map), "client_room_map has stale entries")
+
+    def run_chat(self):
+        """Send --messages chats per client in each of --rounds rounds, timing every round separately."""
+        members = self.members()
+        rooms = {}
+        for client in members:
+            rooms.setdefault(client.room_id, []).append(client)
+
+        expected = {client: [] for client in members} # client -> texts it should receive, in send order per sender
+        probe = self.start_probe()
+        baseline_counts = {client: client.chat_count for client in members}
+        next_seq = {client: 0 for client in members}
+        total = 0
+        throughputs = []
+        for _ in range(self.args.rounds):
+            schedule = [client for client in members for _ in range(self.args.messages)]
+            self.rng.shuffle(schedule)
+            round_total = 0
+            started = time.perf_counter()
+            for sender in schedule:
+                text = f"m{sender.index}.{next_seq[sender]}"
+                next_seq[sender] += 1
+                for recipient in rooms[sender.room_id]:
+                    if recipient is not sender:
+                        expected[recipient].append(text)
+                        round_total += 1
+                sender.send(Event(EventType.CHAT, nickname=sender.nickname, text=text), self.args.codec)
+
+            total += round_total
+            if not self.wait_until(lambda: sum(c.chat_count - baseline_counts[c] for c in members) >= total,
+                                   "chat messages to be delivered"):
+                break
+            if round_total:
+                throughputs.append(round_total / (time.perf_counter() - started))
+        latencies = self.stop_probe(probe)
+
+        senders = {f"m{client.index}": client for client in members}
+        for client in members:
+            chats = [(event, at) for event, at in client.events if event.type == EventType.CHAT]
+            received = [event.text for event, _ in chats]
+            self.check(sorted(received) == sorted(expected[client]),
+                       f"client {client.index} got {len(received)} chats, expected {len(expected[client])} "
+                       f"(lost, duplicated or misrouted)")
+            last_seq = {}
+            for event, at in chats:
+                sender_key, seq = event.text.split(".")
+                self.check(event.nickname == senders[sender_key].nickname,
+                           f"chat {event.text} attributed to {event.nickname}")
+                self.check(int(seq) > last_seq.get(sender_key, -1), f"chat {event.text} arrived out of order")
+                last_seq[sender_key] = int(seq)
+
+        self.metrics['chat_deliveries'] = total
+        # An odd round can run ten times slower with no code change, so the baseline gates on the
+        # median round; the slowest is only reported.
+        self.metrics['chat_throughput'] = statistics.median(throughputs) if throughputs else 0.0
+        self.metrics['chat_throughput_min'] = min(throughputs, default=0.0)
+        if latencies:
+            self.metrics['latency_probes'] = len(latencies)
+            self.metrics['latency_p50_ms'] = latencies[len(latencies) // 2] * 1000
+            self.metrics['latency_p95_ms'] = latencies[int(len(latencies) * 0.95)] * 1000
+            self.metrics['latency_max_ms'] = latencies[-1] * 1000
+
+    def start_probe(self):
+        """Start sending latency probes through a room of their own. Returns the state for stop_probe."""
+        room_id = "probe-room"
+        sender = SimClient(-3, room_id, "pw", "probe-sender", "CREATE")
+        receiver = SimClient(-4, room_id, "pw", "probe-receiver", "JOIN")
+        arrived = threading.Event()
+        arrived_at = []
+
+        def on_event(event, at):
+            if event.type == EventType.CHAT:
+                arrived_at.append(at)
+                arrived.set()
+
+        receiver.on_event = on_event
+        for client in (sender, receiver):
+            client.start(self.listener, self.args.codec)
+            self.wait_until(lambda: client.rejected or client.server_sock in server_core.client_room_map,
+                            f"{client.nickname} to join")
+
+        probe = {'room_id': room_id, 'sender': sender, 'receiver': receiver,
+                 'running': True, 'latencies': [], 'lost': 0}
+
+        def run():
+            # One probe in flight at a time, so probes never queue behind each other
+            while probe['running']:
+                arrived.clear()
+                sent = time.perf_counter()
+                sender.send(Event(EventType.CHAT, nickname=sender.nickname, text="probe"), self.args.codec)
+                if arrived.wait(self.args.timeout):
+                    probe['latencies'].append(arrived_at[-1] - sent)
+                else:
+                    probe['lost'] += 1
+                time.sleep(PROBE_INTERVAL)
+
+        probe['thread'] = threading.Thread(target=run, daemon=True)
+        probe['thread'].start()
+        return probe
+
+    def stop_probe(self, probe):
+        """Stop probing, close the probe room and return the sorted probe latencies in seconds."""
+        probe['running'] = False
+        probe['thread'].join(self.args.timeout + 1)
+        self.check(probe['lost'] == 0, f"{probe['lost']} latency probes were never delivered")
+        self.admin("closing the probe room", self.args.timeout, server_core.close_room, probe['room_id'])
+        return sorted(probe['latencies'])
+
+    def start_stall(self):
+        """Park a client that never reads in its own room and flood it until its socket is full.
+
+        The rest of the run must carry on regardless: the chat phase checks other rooms
+        still get their messages, and finish_stall checks the admin can still kick it.
+        """
+        self.stall_room = "stalled-room"
+        self.flooder = SimClient(-1, self.stall_room, "pw", "flooder", "CREATE")
+        self.stalled = SimClient(-2, self.stall_room, "pw", "stalled", "JOIN", reads=False)
+        for client in (self.flooder, self.stalled):
+            client.start(self.listener, self.args.codec)
+            self.wait_until(lambda: client.rejected or client.server_sock in server_core.client_room_map,
+                            f"{client.nickname} to join")
+        flood = Event(EventType.CHAT, nickname=self.flooder.nickname, text="x" * 60000)
+        threading.Thread(target=lambda: [self.flooder.send(flood, self.args.codec)
+                                         for _ in range(STALL_FLOOD_MESSAGES)], daemon=True).start()
+
+        # Frames pile up in the outbox once the socket buffer is full
+        outbox = server_core.outboxes.get(self.stalled.server_sock)
+        self.check(outbox is not None, "stalled client was dropped before it fell behind")
+        if outbox is not None:
+            self.wait_until(lambda: len(outbox.frames) > 0, "the stalled client's socket to fill up")
+        locked = server_core.state_lock.acquire(timeout=STALL_LOCK_TIMEOUT)
+        self.check(locked, "state_lock is held while a client is not reading")
+        if locked:
+            server_core.state_lock.release()
+
+    def finish_stall(self):
+        try:
+            self.admin("kicking the stalled client", STALL_LOCK_TIMEOUT,
+                       server_core.kick_client, self.stall_room, self.stalled.nickname)
+        except ValueError:
+            self.failures.append("stalled client vanished before it could be kicked")
+        self.check(self.stalled.server_sock not in server_core.client_room_map, "stalled client is still a member")
+        self.admin("closing the stalled room", STALL_LOCK_TIMEOUT, server_core.close_room, self.stall_room)
+        self.stalled.disconnect()
+
+    def run_churn(self):
+        """Leave, disconnect, kick and close rooms in a seeded order, then check who is left."""
+        members = self.members()
+        model = {room_id: {c for c in members if c.room_id == room_id} for room_id in self.room_ids}
+        operations = []
+        for client in members:
+            roll = self.rng.random()
+            if roll < 0.15:
+                operations.append(("leave", client))
+            elif roll < 0.30:
+                operations.append(("disconnect", client))
+            elif roll < 0.40:
+                operations.append(("kick", client))
+        for room_id in self.rng.sample(self.room_ids, max(1, len(self.room_ids) // 4)):
+            operations.append(("close", room_id))
+        self.rng.shuffle(operations)
+
+        kicked, notified_close = [], []
+        for operation, target in operations:
+            if operation == "close":
+                notified_close.extend(model[target])
+                del model[target]
+                self.admin(f"closing {target}", self.args.timeout, server_core.close_room, target)
+                continue
+            if target not in model.get(target.room_id, ()):
+                continue # Room already closed
+            model[target.room_id].discard(target)
+            if operation == "leave":
+                target.send(Event(EventType.LEAVE, nickname=target.nickname), self.args.codec)
+                target.disconnect()
+            elif operation == "disconnect":
+                target.disconnect()
+            else:
+                self.admin(f"kicking client {target.index}", self.args.timeout,
+                           server_core.kick_client, target.room_id, target.nickname)
+                kicked.append(target)
+
+        survivors = {client for clients in model.values() for client in clients}
+        self.wait_until(lambda: len(server_core.client_room_map) == len(survivors), "departures to settle")
+        self.wait_until(lambda: not any(client.thread.is_alive() for client in kicked + notified_close),
+                        "removed clients to see their connection close")
+        self.check_rooms({room_id: sorted(c.nickname for c in clients) for room_id, clients in model.items()})
+        for client in kicked:
+            notices = [event for event in client.received(EventType.KICK) if event.nickname == client.nickname]
+            self.check(len(notices) == 1, f"kicked client {client.index} did not get exactly one kick notice")
+        for client in notified_close:
+            self.check(len(client.received(EventType.ROOM_CLOSED)) == 1,
+                       f"client {client.index} did not get exactly one room close notice")
+        return survivors
+
+    def run_shutdown(self, survivors):
+        self.admin("stopping the server", self.args.timeout, server_core.stop_server)
+        self.wait_until(lambda: all(not client.thread.is_alive() for client in survivors), "clients to be dropped")
+        for client in survivors:
+            self.check(len(client.received(EventType.SHUTDOWN)) == 1,
+                       f"client {client.index} did not get the shutdown notice")
+        self.check(not server_core.rooms and not server_core.client_room_map, "server state not cleared on stop")
+
+    def run(self):
+        server_core.CODEC = self.args.codec
+        server_core.rooms.clear()
+        server_core.client_room_map.clear()
+        self.plan_clients()
+        server_core.start_server(self.listener)
+        try:
+            self.run_joins()
+            if not self.failures:
+                self.start_stall()
+                self.run_chat()
+                self.finish_stall()
+            survivors = self.run_churn() if not self.failures else set()
+            self.run_shutdown(survivors)
+        except ServerFrozen as e:
+            self.failures.append(f"Server froze: {e}")
+        return not self.failures
+
+
+def compare_with_baseline(args, metrics):
+    """Returns a list of regressions, or None if there is no baseline for this configuration.
+
+    With --record-baseline the metrics are stored as the new baseline instead.
+    """
+    key = f"clients={args.clients},rooms={args.rooms},messages={args.messages},rounds={args.rounds},codec={args.codec},seed={args.seed}"
+    try:
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    except FileNotFoundError:
+        baselines = {}
+
+    recorded = {name: metrics[name] for name in ('join_rate', 'chat_throughput', 'latency_p95_ms') if name in metrics}
+    if not args.record_baseline and key not in baselines:
+        print(f"No baseline for {key} in {args.baseline}; run with --record-baseline to record one")
+        return None
+    if args.record_baseline:
+        baselines[key] = recorded
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Recorded baseline for {key} in {args.baseline}")
+        return []
+
+    baseline = baselines[key]
+    regressions = []
+    for name, tolerance in (('join_rate', args.join_tolerance), ('chat_throughput', args.tolerance)):
+        if name in baseline and recorded.get(name, 0) < baseline[name] * (1 - tolerance):
+            regressions.append(f"{name} {recorded.get(name, 0):.0f}/s is below baseline {baseline[name]:.0f}/s")
+    floor = 1 - args.tolerance
+    name = 'latency_p95_ms'
+    if name in baseline and recorded.get(name, float('inf')) > baseline[name] / floor:
+        regressions.append(f"{name} {recorded.get(name, float('inf')):.2f} is above baseline {baseline[name]:.2f}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate many chat clients against the server core.")
+    parser.add_argument('--clients', type=int, default=2000)
+    parser.add_argument('--rooms', type=int, default=40)
+    parser.add_argument('--messages', type=int, default=2, help="chat messages sent by each client per round")
+    parser.add_argument('--rounds', type=int, default=5, help="chat rounds; throughput is the median round")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--codec', default='binary')
+    parser.add_argument('--duplicate-rate', type=float, default=0.05, help="share of clients reusing a nickname")
+    parser.add_argument('--timeout', type=float, default=60.0, help="seconds to wait for each phase to settle")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--record-baseline', action='store_true', help="store this run's metrics as the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed fractional regression")
+    # Joins are timed once per run and vary by about 20% either way between identical runs
+    parser.add_argument('--join-tolerance', type=float, default=0.5, help="allowed fractional join rate regression")
+    args = parser.parse_args(argv)
+    if args.clients < args.rooms:
+        parser.error("--clients must be at least --rooms")
+
+    # Three threads per simulated client: its reader, the server's handle_client and its Outbox writer.
+    # At 2000 clients that is about 6000 threads; 512 KiB stacks keep them to ~3 GiB of address space.
+    threading.stack_size(512 * 1024)
+    simulation = Simulation(args)
+    passed = simulation.run()
+
+    print(f"seed={args.seed} clients={args.clients} rooms={args.rooms} codec={args.codec}")
+    for name, value in simulation.metrics.items():
+        print(f"  {name}: {value:.2f}" if isinstance(value, float) else f"  {name}: {value}")
+    for failure in simulation.failures[:20]:
+        print(f"FAIL: {failure}")
+    if len(simulation.failures) > 20:
+        print(f"... and {len(simulation.failures) - 20} more failures")
+    if not passed:
+        return 1
+
+    regressions = compare_with_baseline(args, simulation.metrics)
+    if regressions is None:
+        return 2
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())